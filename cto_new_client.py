@@ -1,14 +1,26 @@
 import asyncio
-import json
+import base64
+import time
 import uuid
-from typing import AsyncGenerator, Any, Dict, Optional
+from collections import ChainMap
+from typing import AsyncGenerator, Any, Callable, Dict, List, Literal, Optional, Tuple, Union, overload
 
+import aiohttp
+import orjson
+from curl_cffi import CurlHttpVersion
 from curl_cffi import requests as cffi_requests
-import websockets
-from websockets.exceptions import ConnectionClosed
 
 from ua_utils import BrowserFingerprint
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+Transport = Literal["curl_cffi", "httpx"]
+# 两种传输层的网络错误统一按同一组异常处理
+_HTTP_ERRORS: Tuple[type, ...] = (cffi_requests.errors.RequestsError,) + ((httpx.HTTPError,) if httpx else ())
+
 
 # ========== 自定义异常 ==========
 class CtoNewError(Exception):
@@ -18,9 +30,19 @@ class CtoNewError(Exception):
 
 
 class AuthError(CtoNewError):
-    """认证失败错误"""
+    """
+    认证失败错误。
+    status_code 为服务端返回的错误状态码；网络错误、响应内容不符合预期等情况为 None
+    """
 
-    pass
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def rejected(self) -> bool:
+        """服务端明确拒绝凭据（401/403），而非网络抖动、5xx 等暂时性失败"""
+        return self.status_code in _REJECTED_STATUS
 
 
 class ApiError(CtoNewError):
@@ -29,52 +51,319 @@ class ApiError(CtoNewError):
     pass
 
 
+def _error_body(exc: Exception) -> str:
+    response = getattr(exc, "response", None)
+    return response.text[:200] if response is not None else "No response"
+
+
+# 表示凭据本身被拒绝的状态码，与网络抖动、服务端 5xx 区分开
+_REJECTED_STATUS = (401, 403)
+
+
+def _raise_auth_status(response, action: str):
+    """
+    响应为错误状态码时抛出带状态码的 AuthError。
+    curl_cffi 的 raise_for_status 不附带响应，状态码与响应体只能在此处取得
+    """
+    if response.status_code >= 400:
+        raise AuthError(
+            f"{action}失败：HTTP {response.status_code} - {response.text[:200]}",
+            status_code=response.status_code,
+        )
+
+
+# ========== 共享会话池 ==========
+# 按 (transport, impersonate, proxy, cookie) 复用 HTTP 会话，避免每个客户端都重新进行 TCP + TLS 握手。
+# key 必须包含 cookie：会话自带 cookie jar，不同账号共用会话时，一个账号响应里的 Set-Cookie 会被带到另一个账号的请求上
+_SessionKey = Tuple[str, str, Optional[str], str]
+# 共享会话的最大并发连接数；curl_cffi 默认仅 10 个 handle，高并发时会排队
+SESSION_MAX_CLIENTS = 256
+HttpSession = Union[cffi_requests.AsyncSession, "httpx.AsyncClient"]
+_SESSION_POOL: Dict[_SessionKey, HttpSession] = {}
+_SESSION_REFCOUNT: Dict[_SessionKey, int] = {}
+# WebSocket 走 aiohttp，与 HTTP 会话共用同一个 key，但引用计数独立：
+# 传入 shared_client 的客户端不持有 HTTP 会话，却仍会使用并需要释放 WebSocket 会话
+_WS_SESSION_POOL: Dict[_SessionKey, aiohttp.ClientSession] = {}
+_WS_SESSION_REFCOUNT: Dict[_SessionKey, int] = {}
+# 同一会话上的客户端共用一个浏览器指纹，保持服务端看到的指纹一致；
+# 与 WebSocket 会话的引用计数同生命周期，该 key 的最后一个客户端关闭时连同 headers 缓存一起丢弃
+_FP_CACHE: Dict[_SessionKey, BrowserFingerprint] = {}
+# 相同指纹、相同参数构建出的 headers 完全一致，按指纹分组缓存
+_HEADERS_CACHE: Dict[BrowserFingerprint, Dict[tuple, Dict[str, str]]] = {}
+
+
+def _create_session(transport: Transport, impersonate: str, proxy: Optional[str]) -> HttpSession:
+    if transport == "httpx":
+        if httpx is None:
+            raise CtoNewError("使用 httpx 传输层需要先安装 httpx")
+        return httpx.AsyncClient(
+            proxy=proxy,
+            timeout=30,
+            limits=httpx.Limits(max_connections=SESSION_MAX_CLIENTS),
+        )
+
+    proxies = {"http": proxy, "https": proxy} if proxy else None
+    # 使用 impersonate 模拟真实浏览器的 TLS 指纹，这是对抗指纹识别的关键
+    return cffi_requests.AsyncSession(
+        impersonate=impersonate,
+        proxies=proxies,
+        timeout=30,
+        max_clients=SESSION_MAX_CLIENTS,
+        # HTTPS 上协商 HTTP/2，让 Clerk 与 enginelabs 的请求在少量连接上多路复用
+        http_version=CurlHttpVersion.V2TLS,
+    )
+
+
+def _get_shared_session(transport: Transport, impersonate: str, proxy: Optional[str], cookie: str) -> HttpSession:
+    """获取共享的 HTTP 会话，不存在时创建，并增加引用计数"""
+    # 整个过程没有 await，在事件循环内天然是原子的，无需额外加锁
+    key = (transport, impersonate, proxy, cookie)
+    session = _SESSION_POOL.get(key)
+    if session is None:
+        session = _create_session(transport, impersonate, proxy)
+        _SESSION_POOL[key] = session
+    _SESSION_REFCOUNT[key] = _SESSION_REFCOUNT.get(key, 0) + 1
+    return session
+
+
+def _get_shared_fingerprint(
+    transport: Transport, impersonate: str, proxy: Optional[str], cookie: str
+) -> BrowserFingerprint:
+    """获取与共享会话绑定的浏览器指纹，首次使用时生成；同一账号始终呈现同一个指纹"""
+    key = (transport, impersonate, proxy, cookie)
+    fingerprint = _FP_CACHE.get(key)
+    if fingerprint is None:
+        fingerprint = _FP_CACHE[key] = BrowserFingerprint.create()
+    return fingerprint
+
+
+def _get_shared_ws_session(
+    transport: Transport, impersonate: str, proxy: Optional[str], cookie: str
+) -> aiohttp.ClientSession:
+    """获取共享的 aiohttp 会话，必须在事件循环内调用，因此按需创建"""
+    key = (transport, impersonate, proxy, cookie)
+    session = _WS_SESSION_POOL.get(key)
+    if session is None or session.closed:
+        # 认证信息都在 URL 的 token 里，不需要也不应保存服务端下发的 cookie
+        session = aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar())
+        _WS_SESSION_POOL[key] = session
+    return session
+
+
+def _retain_ws_session(transport: Transport, impersonate: str, proxy: Optional[str], cookie: str):
+    """登记一个 WebSocket 会话的使用者；会话本身在首次建立连接时才创建"""
+    key = (transport, impersonate, proxy, cookie)
+    _WS_SESSION_REFCOUNT[key] = _WS_SESSION_REFCOUNT.get(key, 0) + 1
+
+
+async def _release_ws_session(transport: Transport, impersonate: str, proxy: Optional[str], cookie: str):
+    """减少 WebSocket 会话的引用计数，最后一个使用者释放时关闭会话，并丢弃该 key 的指纹与 headers 缓存"""
+    key = (transport, impersonate, proxy, cookie)
+    remaining = _WS_SESSION_REFCOUNT.get(key, 0) - 1
+    if remaining > 0:
+        _WS_SESSION_REFCOUNT[key] = remaining
+        return
+
+    _WS_SESSION_REFCOUNT.pop(key, None)
+    # 每个客户端都持有 WebSocket 引用，计数归零即说明该 cookie 已没有存活的客户端
+    fingerprint = _FP_CACHE.pop(key, None)
+    if fingerprint is not None:
+        _HEADERS_CACHE.pop(fingerprint, None)
+    ws_session = _WS_SESSION_POOL.pop(key, None)
+    if ws_session is not None:
+        await ws_session.close()
+
+
+async def _release_shared_session(transport: Transport, impersonate: str, proxy: Optional[str], cookie: str):
+    """减少引用计数，最后一个使用者释放时才真正关闭会话"""
+    key = (transport, impersonate, proxy, cookie)
+    remaining = _SESSION_REFCOUNT.get(key, 0) - 1
+    if remaining > 0:
+        _SESSION_REFCOUNT[key] = remaining
+        return
+
+    _SESSION_REFCOUNT.pop(key, None)
+    session = _SESSION_POOL.pop(key, None)
+    if isinstance(session, cffi_requests.AsyncSession):
+        await session.close()
+    elif session is not None:
+        await session.aclose()
+
+
 # ========== 核心客户端 ==========
 class CtoNewClient:
     """
     与 cto.new 后端服务交互的异步客户端。
-    使用 curl_cffi 模拟浏览器 TLS 指纹，并支持代理。
+    默认使用 curl_cffi 模拟浏览器 TLS 指纹，也可通过 `transport="httpx"` 切换到 httpx，并支持代理。
+    WebSocket 流经 aiohttp 建立，只会走 HTTP(S) 代理；配置 socks 等代理时 WebSocket 直连。
+    相同 (transport, impersonate, proxy, cookie) 的客户端共享同一个 HTTP 会话，
+    可通过 `async with` 或 `close()` 释放引用；传入 `shared_client` 时由调用方自行管理该 HTTP 客户端的生命周期，
+    但仍需 `close()` 以释放 WebSocket 会话。
+    高并发场景可在启动事件循环前调用 `CtoNewClient.install_fast_loop()`，
+    或将 `CtoNewClient.fast_loop_factory()` 传给 `asyncio.Runner`，切换到 uvloop。
     """
 
     BASE_URL = "https://api.enginelabs.ai/engine-agent"
     CLERK_URL = "https://clerk.cto.new"
     CLERK_API_VERSION = "2025-04-10"
     CLERK_JS_VERSION = "5.102.1"
-
-    def __init__(self, cookie: str, proxy: Optional[str] = None):
+    IMPERSONATE = "chrome120"
+    # JWT 剩余有效期低于该秒数时视为需要刷新；Clerk 的 token 通常只有 60 秒有效期，
+    # 实际余量取该值与 token 有效期一半中的较小者，避免 token 一拿到就被判定为过期
+    JWT_REFRESH_MARGIN = 30
+    # create_chats 的最大并发请求数
+    CHAT_FANOUT_LIMIT = 32
+
+    # 固定不变的 URL、查询参数与附加 headers，只构建一次
+    _CLERK_PARAMS = {"__clerk_api_version": CLERK_API_VERSION, "_clerk_js_version": CLERK_JS_VERSION}
+    _CLERK_QS = f"?__clerk_api_version={CLERK_API_VERSION}&_clerk_js_version={CLERK_JS_VERSION}"
+    _CLIENT_URL = f"{CLERK_URL}/v1/client"
+    _MEMBERSHIPS_URL = f"{CLERK_URL}/v1/me/organization_memberships"
+    _MEMBERSHIPS_PARAMS = {**_CLERK_PARAMS, "paginated": "true", "limit": "10", "offset": "0"}
+    _TOUCH_URL_TMPL = CLERK_URL + "/v1/client/sessions/{sid}/touch" + _CLERK_QS
+    _TOKENS_URL_TMPL = CLERK_URL + "/v1/client/sessions/{sid}/tokens" + _CLERK_QS
+    _CHAT_URL = f"{BASE_URL}/chat"
+    _WS_URL_TMPL = "wss://api.enginelabs.ai/engine-agent/chat-histories/{chat_id}/buffer/stream?token={token}"
+    _SAME_SITE_HDR = {"Accept": "*/*", "Sec-Fetch-Site": "same-site"}
+    _TOUCH_HDR = {
+        "Accept": "*/*",
+        "Sec-Fetch-Site": "same-site",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
+    _CROSS_SITE_HDR = {"Sec-Fetch-Site": "cross-site"}
+
+    # update 帧走字符串切片快速路径；服务端格式变化时可关闭，退回完整解析
+    FAST_FRAME_PARSE = True
+    _UPDATE_MARKER = '"type":"update"'
+    _BUFFER_MARKER = '"buffer":"'
+    # WebSocket 收帧任务与消费者之间的缓冲帧数
+    WS_QUEUE_SIZE = 64
+    # WebSocket 连续多少秒收不到任何帧即结束流；heartbeat 只在 pong 缺失时断开，
+    # 对端持续回 pong 却不再推送数据时需要靠它兜底
+    WS_RECEIVE_TIMEOUT = 30
+
+    def __init__(
+        self,
+        cookie: str,
+        proxy: Optional[str] = None,
+        *,
+        transport: Transport = "curl_cffi",
+        shared_client: Optional[HttpSession] = None,
+    ):
         self._cookie = cookie
         self._jwt: Optional[str] = None
+        self._jwt_refresh_at: Optional[float] = None
+        self._auth_lock: Optional[asyncio.Lock] = None
         self._ws_user_token: Optional[str] = None
         self._session_id: Optional[str] = None
         self._active_org_id: Optional[str] = None
-        self._fingerprint = BrowserFingerprint.create()
+        self._transport: Transport = transport
+        self._fingerprint = _get_shared_fingerprint(transport, self.IMPERSONATE, proxy, cookie)
+        self._is_httpx = transport == "httpx"
+        # 两种会话在重定向与原始请求体上的参数名不同
+        self._redirect_kwargs = {"follow_redirects": True} if self._is_httpx else {"allow_redirects": True}
+        self._raw_body_kwarg = "content" if self._is_httpx else "data"
+
+        self._proxy = proxy
+        # aiohttp 只支持 HTTP(S) 代理；socks 等其他代理只用于 HTTP 请求，WebSocket 直连
+        self._ws_proxy = proxy if proxy and proxy.lower().startswith(("http://", "https://")) else None
+        self._owns_client = shared_client is None
+        self._closed = False
+        if shared_client is not None:
+            self._client = shared_client
+        else:
+            self._client = _get_shared_session(transport, self.IMPERSONATE, proxy, cookie)
+        _retain_ws_session(transport, self.IMPERSONATE, proxy, cookie)
 
-        proxies = {"http": proxy, "https": proxy} if proxy else None
-        # 使用 impersonate 模拟真实浏览器的 TLS 指纹，这是对抗指纹识别的关键
-        self._client = cffi_requests.AsyncSession(
-            impersonate="chrome120",
-            proxies=proxies,
-            timeout=30,
-        )
+    @staticmethod
+    def install_fast_loop() -> bool:
+        """安装 uvloop 事件循环策略（可选依赖），成功返回 True，不可用时保持默认并返回 False"""
+        try:
+            import uvloop
+        except ImportError:
+            return False
+        uvloop.install()
+        return True
+
+    @staticmethod
+    def fast_loop_factory() -> Optional[Callable[[], asyncio.AbstractEventLoop]]:
+        """
+        返回 uvloop 的事件循环工厂（可选依赖），不可用时返回 None。
+        可直接传给 `asyncio.Runner(loop_factory=...)`，不修改全局策略（Python 3.12+ 已不推荐 uvloop.install()）
+        """
+        try:
+            import uvloop
+        except ImportError:
+            return None
+        return uvloop.new_event_loop
+
+    async def __aenter__(self) -> "CtoNewClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """释放对共享会话的引用，可重复调用；WebSocket 会话总是由客户端自己管理，即使传入了 shared_client"""
+        if self._closed:
+            return
+        self._closed = True
+        await _release_ws_session(self._transport, self.IMPERSONATE, self._proxy, self._cookie)
+        if self._owns_client:
+            await _release_shared_session(self._transport, self.IMPERSONATE, self._proxy, self._cookie)
+
+    async def _post(self, url: str, headers: Dict[str, str], content: Optional[Union[str, bytes]] = None, **kwargs):
+        """按当前传输层发送 POST，原始请求体通过 content 传入"""
+        if content is not None:
+            kwargs[self._raw_body_kwarg] = content
+        return await self._client.post(url, headers=headers, **kwargs, **self._redirect_kwargs)
+
+    def _cached_headers(
+        self,
+        target_url: Optional[str] = None,
+        origin: Optional[str] = None,
+        referer: Optional[str] = None,
+        additional_headers: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, str]:
+        """返回缓存的指纹 headers 浅拷贝，调用方可以放心追加 cookie/authorization"""
+        cache = _HEADERS_CACHE.get(self._fingerprint)
+        if cache is None:
+            cache = _HEADERS_CACHE[self._fingerprint] = {}
+
+        key = (target_url, origin, referer, frozenset(additional_headers.items()) if additional_headers else None)
+        cached = cache.get(key)
+        if cached is None:
+            cached = self._fingerprint.build_headers(
+                target_url=target_url,
+                origin=origin,
+                referer=referer,
+                additional_headers=additional_headers,
+            )
+            cache[key] = cached
+        return dict(cached)
 
     async def _get_clerk_info(self):
         """获取 Clerk 会话信息"""
-        params = {
-            "__clerk_api_version": self.CLERK_API_VERSION,
-            "_clerk_js_version": self.CLERK_JS_VERSION,
-        }
-        headers = self._fingerprint.build_headers(
+        params = self._CLERK_PARAMS
+        headers = self._cached_headers(
             target_url=self.CLERK_URL,
             origin="https://cto.new",
             referer="https://cto.new/",
-            additional_headers={"Accept": "*/*", "Sec-Fetch-Site": "same-site"},
+            additional_headers=self._SAME_SITE_HDR,
         )
         headers["cookie"] = self._cookie
 
         try:
-            client_url = f"{self.CLERK_URL}/v1/client"
-            r = await self._client.get(client_url, headers=headers, params=params)
-            r.raise_for_status()
+            # 组织成员信息只在 /v1/client 缺少 token 时才用得上，提前并发请求以隐藏这一个 RTT
+            client_result, memberships_data = await asyncio.gather(
+                self._client.get(self._CLIENT_URL, headers=headers, params=params),
+                self._fetch_memberships(headers),
+                return_exceptions=True,
+            )
+            if isinstance(client_result, BaseException):
+                raise client_result
+            r = client_result
+            _raise_auth_status(r, "获取 Clerk 信息")
             payload = r.json()
 
             client_data = payload.get("response") or payload.get("client") or {}
@@ -83,7 +372,7 @@ class CtoNewClient:
                 raise AuthError("Clerk 响应中没有可用的 session")
 
             self._session_id = client_data.get("last_active_session_id") or sessions[0].get("id")
-            session = next((s for s in sessions if s.get("id") == self._session_id), sessions[0])
+            session = {s.get("id"): s for s in sessions}.get(self._session_id, sessions[0])
             self._active_org_id = (
                 client_data.get("last_active_organization_id")
                 or session.get("last_active_organization_id")
@@ -91,7 +380,7 @@ class CtoNewClient:
             )
 
             # 透传已有 token，避免重复刷新；缺失时由 _refresh_jwt 兜底
-            self._jwt = session.get("last_active_token", {}).get("jwt") or self._jwt
+            self._set_jwt(session.get("last_active_token", {}).get("jwt") or self._jwt)
             self._ws_user_token = (
                 session.get("ws_user_token")
                 or session.get("wsToken")
@@ -100,52 +389,52 @@ class CtoNewClient:
             )
 
             if not self._session_id or not self._ws_user_token:
-                await self._hydrate_ws_token_from_memberships(headers, params)
+                if isinstance(memberships_data, dict):
+                    self._hydrate_ws_token_from_memberships(memberships_data)
                 if not self._session_id or not self._ws_user_token:
                     raise AuthError("无法在 Clerk 响应中找到 session 或 WebSocket token 信息")
 
-        except cffi_requests.errors.RequestsError as e:
-            body = e.response.text[:200] if e.response else "No response"
+        except _HTTP_ERRORS as e:
+            body = _error_body(e)
             raise AuthError(f"获取 Clerk 信息失败: {e} - {body}") from e
         except (KeyError, IndexError) as e:
             raise AuthError(f"解析 Clerk 响应失败: {e}") from e
 
-    async def _hydrate_ws_token_from_memberships(self, base_headers: Dict[str, str], base_params: Dict[str, str]):
-        """部分账户需要额外查询组织信息来拿到 ws token"""
-        url = f"{self.CLERK_URL}/v1/me/organization_memberships"
-        headers = dict(base_headers)
-        headers.setdefault("Accept", "application/json")
-
-        params = dict(base_params)
-        params.update({"paginated": "true", "limit": "10", "offset": "0"})
+    async def _fetch_memberships(self, base_headers: Dict[str, str]) -> Optional[Dict]:
+        """查询组织成员信息，请求失败时返回 None"""
+        url = self._MEMBERSHIPS_URL
+        # 以 ChainMap 叠加默认值，等价于 setdefault，但无需复制整份 headers
+        headers = ChainMap(base_headers, {"Accept": "application/json"})
 
         try:
-            r = await self._client.get(url, headers=headers, params=params)
+            r = await self._client.get(url, headers=headers, params=self._MEMBERSHIPS_PARAMS)
             r.raise_for_status()
-            data = r.json()
+            return r.json()
+        except _HTTP_ERRORS:
+            return None
 
-            client_data = data.get("client", {})
-            sessions = client_data.get("sessions", [])
-            if not sessions:
-                return
-
-            if not self._session_id:
-                self._session_id = client_data.get("last_active_session_id") or sessions[0].get("id")
-            session = next((s for s in sessions if s.get("id") == self._session_id), sessions[0])
-
-            self._ws_user_token = self._ws_user_token or session.get("ws_user_token") or session.get("wsToken")
-            if not self._ws_user_token:
-                self._ws_user_token = session.get("user", {}).get("id")
-
-            if not self._active_org_id:
-                self._active_org_id = (
-                    client_data.get("last_active_organization_id")
-                    or session.get("last_active_organization_id")
-                    or self._extract_active_org(client_data)
-                )
-        except cffi_requests.errors.RequestsError:
+    def _hydrate_ws_token_from_memberships(self, data: Dict[str, Any]):
+        """部分账户需要额外查询组织信息来拿到 ws token"""
+        client_data = data.get("client", {})
+        sessions = client_data.get("sessions", [])
+        if not sessions:
             return
 
+        if not self._session_id:
+            self._session_id = client_data.get("last_active_session_id") or sessions[0].get("id")
+        session = {s.get("id"): s for s in sessions}.get(self._session_id, sessions[0])
+
+        self._ws_user_token = self._ws_user_token or session.get("ws_user_token") or session.get("wsToken")
+        if not self._ws_user_token:
+            self._ws_user_token = session.get("user", {}).get("id")
+
+        if not self._active_org_id:
+            self._active_org_id = (
+                client_data.get("last_active_organization_id")
+                or session.get("last_active_organization_id")
+                or self._extract_active_org(client_data)
+            )
+
     @staticmethod
     def _extract_active_org(client_data: Dict[str, Any]) -> Optional[str]:
         memberships = client_data.get("organization_memberships") or []
@@ -155,23 +444,17 @@ class CtoNewClient:
                 return org.get("id")
         return None
 
-    async def _touch_session(self):
+    async def _touch_session(self) -> Optional[str]:
+        """写回当前组织 ID 并刷新会话状态，返回响应中携带的 JWT（若有）"""
         if not self._session_id:
             raise AuthError("刷新会话前必须先获取 session_id")
 
-        url = (
-            f"{self.CLERK_URL}/v1/client/sessions/{self._session_id}/touch"
-            f"?__clerk_api_version={self.CLERK_API_VERSION}&_clerk_js_version={self.CLERK_JS_VERSION}"
-        )
-        headers = self._fingerprint.build_headers(
+        url = self._TOUCH_URL_TMPL.format(sid=self._session_id)
+        headers = self._cached_headers(
             target_url=self.CLERK_URL,
             origin="https://cto.new",
             referer="https://cto.new/",
-            additional_headers={
-                "Accept": "*/*",
-                "Sec-Fetch-Site": "same-site",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
+            additional_headers=self._TOUCH_HDR,
         )
         headers["cookie"] = self._cookie
         payload = {}
@@ -179,106 +462,322 @@ class CtoNewClient:
             payload["active_organization_id"] = self._active_org_id
 
         try:
-            r = await self._client.post(url, headers=headers, data=payload, follow_redirects=True)
-            r.raise_for_status()
+            r = await self._post(url, headers, data=payload)
+            _raise_auth_status(r, "刷新 session 状态")
             token = r.json().get("jwt")
             if token:
-                self._jwt = token
-        except cffi_requests.errors.RequestsError as e:
-            body = e.response.text[:200] if e.response else "No response"
+                self._set_jwt(token)
+            return token
+        except _HTTP_ERRORS as e:
+            body = _error_body(e)
             raise AuthError(f"刷新 session 状态失败: {e} - {body}") from e
 
+    @staticmethod
+    def _decode_jwt_times(token: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+        """解析 JWT payload 中的 (exp, iat)（不校验签名），无法解析的字段返回 None"""
+        if not token:
+            return None, None
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            claims = orjson.loads(base64.urlsafe_b64decode(payload))
+            exp, iat = claims.get("exp"), claims.get("iat")
+        except (IndexError, ValueError, AttributeError):
+            return None, None
+        return (
+            float(exp) if isinstance(exp, (int, float)) else None,
+            float(iat) if isinstance(iat, (int, float)) else None,
+        )
+
+    @classmethod
+    def _jwt_refresh_deadline(cls, token: Optional[str]) -> Optional[float]:
+        """计算应当刷新 JWT 的时间点；exp 无法解析时返回 None，表示不做预判、视为有效"""
+        exp, iat = cls._decode_jwt_times(token)
+        if exp is None:
+            return None
+        margin = cls.JWT_REFRESH_MARGIN
+        if iat is not None and exp > iat:
+            margin = min(margin, (exp - iat) / 2)
+        return exp - margin
+
+    def _set_jwt(self, token: Optional[str]):
+        """更新 JWT 并同步缓存其刷新时间点"""
+        if token != self._jwt:
+            self._jwt_refresh_at = self._jwt_refresh_deadline(token)
+        self._jwt = token
+
+    def _jwt_is_fresh(self) -> bool:
+        """JWT 存在且未到刷新时间点；exp 无法解析时统一视为有效，过期与否交由服务端判定"""
+        if not self._jwt:
+            return False
+        return self._jwt_refresh_at is None or time.time() < self._jwt_refresh_at
+
     async def _refresh_jwt(self):
         """刷新 JWT"""
         if not self._session_id:
             raise AuthError("刷新 JWT 前必须先获取 session_id")
 
         await self._touch_session()
+        self._set_jwt(await self._request_session_token())
 
-        url = (
-            f"{self.CLERK_URL}/v1/client/sessions/{self._session_id}/tokens"
-            f"?__clerk_api_version={self.CLERK_API_VERSION}&_clerk_js_version={self.CLERK_JS_VERSION}"
-        )
-        headers = self._fingerprint.build_headers(
+    async def _request_session_token(self) -> str:
+        """调用 /tokens 生成新的会话 JWT"""
+        if not self._session_id:
+            raise AuthError("刷新 JWT 前必须先获取 session_id")
+
+        url = self._TOKENS_URL_TMPL.format(sid=self._session_id)
+        headers = self._cached_headers(
             target_url=self.CLERK_URL,
             origin="https://cto.new",
             referer="https://cto.new/",
-            additional_headers={"Accept": "*/*", "Sec-Fetch-Site": "same-site"},
+            additional_headers=self._SAME_SITE_HDR,
         )
         headers["cookie"] = self._cookie
         headers["content-type"] = "application/x-www-form-urlencoded"
 
         try:
-            r = await self._client.post(url, headers=headers, data="", follow_redirects=True)
-            r.raise_for_status()
-            self._jwt = r.json().get("jwt")
-            if not self._jwt:
+            r = await self._post(url, headers, content="")
+            _raise_auth_status(r, "刷新 JWT")
+            jwt = r.json().get("jwt")
+            if not jwt:
                 raise AuthError("JWT 为空")
-        except cffi_requests.errors.RequestsError as e:
-            body = e.response.text[:200] if e.response else "No response"
+            return jwt
+        except _HTTP_ERRORS as e:
+            body = _error_body(e)
             raise AuthError(f"刷新 JWT 失败：{e} - {body}") from e
 
+    def _get_auth_lock(self) -> asyncio.Lock:
+        # 延迟创建，确保锁绑定到实际运行的事件循环
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        return self._auth_lock
+
     async def authenticate(self):
-        """执行完整的认证流程"""
+        """执行完整的认证流程；并发调用时只有一个真正发起请求，其余等待并复用结果"""
+        async with self._get_auth_lock():
+            # 等锁期间其他协程可能已经完成认证
+            if self._jwt_is_fresh() and self._ws_user_token:
+                return
+            await self._authenticate()
+
+    async def _authenticate(self):
         await self._get_clerk_info()
-        await self._refresh_jwt()
 
-    async def create_chat(self, prompt: str, adapter: str) -> str:
-        """创建新的聊天会话"""
-        if not self._jwt:
+        # /v1/client 已经带回未过期的 JWT 时，无需再走 touch → tokens
+        if self._jwt_is_fresh():
+            return
+
+        # touch 负责写回 active_organization_id，此时 tokens 必须在其之后签发，JWT 才带有组织上下文
+        if self._active_org_id:
+            await self._refresh_jwt()
+            return
+
+        # 没有组织需要切换时，Clerk 并不强制 tokens 必须在 touch 之后，并发发出以节省一个 RTT
+        touch_result, token_result = await asyncio.gather(
+            self._touch_session(),
+            self._request_session_token(),
+            return_exceptions=True,
+        )
+        if isinstance(touch_result, BaseException):
+            raise touch_result
+        if isinstance(token_result, BaseException):
+            # 仅当 tokens 因缺少前置 touch 被拒（400/401）时回退到串行的 touch → tokens
+            if isinstance(token_result, AuthError) and token_result.status_code in (400, 401):
+                await self._refresh_jwt()
+                return
+            raise token_result
+        # touch 响应带回 JWT 时以它为准，否则使用 tokens 签发的 JWT
+        self._set_jwt(touch_result or token_result)
+
+    async def _refresh_rejected_jwt(self, rejected: Optional[str]):
+        """后端以 401 拒绝 JWT 时强制走 touch → tokens；并发请求中只有一个真正刷新"""
+        async with self._get_auth_lock():
+            # 等锁期间其他协程已经换上了新的 JWT
+            if self._jwt != rejected:
+                return
+            await self._refresh_jwt()
+
+    async def create_chat(self, prompt: str, adapter: str, chat_id: Optional[str] = None) -> str:
+        """
+        创建新的聊天会话并发送 prompt。
+        chat_id 由客户端生成；调用方可以传入已有的 chat_id，在多轮对话中沿用同一个会话。
+        应在本方法返回后再订阅该会话的流，提前订阅可能收到上一轮已结束的状态。
+        """
+        if not self._jwt_is_fresh():
             await self.authenticate()
 
-        chat_id = str(uuid.uuid4())
-        url = f"{self.BASE_URL}/chat"
-        headers = self._fingerprint.build_headers(
+        if chat_id is None:
+            chat_id = str(uuid.uuid4())
+        url = self._CHAT_URL
+        headers = self._cached_headers(
             target_url=self.BASE_URL,
             origin="https://cto.new",
             referer="https://cto.new/",
-            additional_headers={"Sec-Fetch-Site": "cross-site"},
+            additional_headers=self._CROSS_SITE_HDR,
         )
-        headers["authorization"] = f"Bearer {self._jwt}"
-        data = {"prompt": prompt, "chatHistoryId": chat_id, "adapterName": adapter}
+        headers["content-type"] = "application/json"
+        # 预先用 orjson 序列化，避免 HTTP 库对大 prompt 走标准库 json.dumps
+        body = orjson.dumps({"prompt": prompt, "chatHistoryId": chat_id, "adapterName": adapter})
 
         try:
-            r = await self._client.post(url, headers=headers, json=data, follow_redirects=True)
+            jwt = self._jwt
+            headers["authorization"] = f"Bearer {jwt}"
+            r = await self._post(url, headers, content=body)
+            if r.status_code == 401:
+                # 本地按 exp 判断仍有效、服务端却已拒绝（如会话被提前吊销）时，刷新一次 JWT 后重试
+                await self._refresh_rejected_jwt(jwt)
+                headers["authorization"] = f"Bearer {self._jwt}"
+                r = await self._post(url, headers, content=body)
             r.raise_for_status()
             return chat_id
-        except cffi_requests.errors.RequestsError as e:
+        except _HTTP_ERRORS as e:
             raise ApiError(f"创建聊天失败：{e}") from e
 
-    async def stream_chat_response(self, chat_id: str) -> AsyncGenerator[str, None]:
-        """通过 WebSocket 流式获取 AI 响应"""
+    async def create_chats(self, jobs: List[Tuple[str, str]]) -> List[str]:
+        """并发创建多个聊天会话，jobs 为 (prompt, adapter) 列表，返回的 chat_id 与输入顺序一致"""
+        if not self._jwt_is_fresh():
+            await self.authenticate()
+
+        semaphore = asyncio.Semaphore(self.CHAT_FANOUT_LIMIT)
+
+        async def _create(prompt: str, adapter: str) -> str:
+            async with semaphore:
+                return await self.create_chat(prompt, adapter)
+
+        return list(await asyncio.gather(*(_create(prompt, adapter) for prompt, adapter in jobs)))
+
+    @classmethod
+    def _fast_update_buffer(cls, raw: str) -> Optional[str]:
+        """直接从 update 帧中切出 buffer 字符串，跳过外层 JSON 解析；无法处理时返回 None"""
+        if cls._UPDATE_MARKER not in raw[:64]:
+            return None
+        start = raw.find(cls._BUFFER_MARKER)
+        end = raw.rfind('"')
+        # 仅处理 buffer 为最后一个字段的帧，其余情况交给通用路径
+        if start < 0 or end <= start or raw[end + 1 :].strip() != "}":
+            return None
+        try:
+            # 连同两侧引号按 JSON 字符串反转义
+            buffer = orjson.loads(raw[start + len(cls._BUFFER_MARKER) - 1 : end + 1])
+        except orjson.JSONDecodeError:
+            return None
+        return buffer if isinstance(buffer, str) else None
+
+    @classmethod
+    def _parse_frame(cls, raw: Union[str, bytes]) -> Tuple[Optional[str], bool]:
+        """解析单个 WebSocket 帧，返回 (内容, 是否结束)；按已知结构直接取键，结构不符时按无内容处理"""
+        buffer = cls._fast_update_buffer(raw) if cls.FAST_FRAME_PARSE and isinstance(raw, str) else None
+        if buffer is None:
+            data = orjson.loads(raw)
+            kind = data.get("type")
+            if kind == "state":
+                return None, not data["state"].get("inProgress")
+            if kind != "update":
+                return None, False
+            buffer = data.get("buffer")
+            if not buffer:
+                return None, False
+
+        inner = orjson.loads(buffer)
+        try:
+            if inner["type"] != "chat":
+                return None, False
+            return inner["chat"]["content"], False
+        except (KeyError, TypeError):
+            return None, False
+
+    @classmethod
+    def _read_ws_message(cls, msg: Any) -> Tuple[Optional[str], bool]:
+        """处理收帧任务放入队列的一项，返回 (内容, 是否结束)；读任务转交的异常在此抛出"""
+        if msg is None:
+            return None, True
+        if isinstance(msg, Exception):
+            raise msg
+        if msg.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+            return None, True
+        try:
+            return cls._parse_frame(msg.data)
+        except (orjson.JSONDecodeError, KeyError):
+            return None, False
+
+    @overload
+    def stream_chat_response(
+        self, chat_id: str, *, coalesce: bool = ..., as_bytes: Literal[False] = ...
+    ) -> AsyncGenerator[str, None]: ...
+
+    @overload
+    def stream_chat_response(
+        self, chat_id: str, *, coalesce: bool = ..., as_bytes: Literal[True]
+    ) -> AsyncGenerator[bytes, None]: ...
+
+    async def stream_chat_response(
+        self, chat_id: str, *, coalesce: bool = False, as_bytes: bool = False
+    ) -> AsyncGenerator[Union[str, bytes], None]:
+        """
+        通过 WebSocket 流式获取 AI 响应。
+        coalesce=True 时，把队列中已经到达的帧合并为一段输出，队列一空立即产出：
+        上游空闲时不增加任何延迟，消费方跟不上时自动攒批，无需定时器。
+        as_bytes=True 时每段内容在此处以 UTF-8 编码一次后产出，写 stdout.buffer / socket 的调用方无需再自行编码
+        """
         if not self._ws_user_token:
             await self.authenticate()
 
-        ws_url = (
-            f"wss://api.enginelabs.ai/engine-agent/chat-histories/{chat_id}"
-            f"/buffer/stream?token={self._ws_user_token}"
-        )
+        ws_url = self._WS_URL_TMPL.format(chat_id=chat_id, token=self._ws_user_token)
 
         try:
-            # 注意：websockets 不通过 curl_cffi，所以代理需要单独配置（如果需要）
-            # 但通常 WebSocket 的指纹检测没有 HTTP 严格
+            # WebSocket 不经过 curl_cffi，而是使用 aiohttp，吞吐远高于纯 Python 实现
+            # 通常 WebSocket 的指纹检测没有 HTTP 严格
             ws_headers = self._fingerprint.build_ws_headers(origin="https://cto.new", referer="https://cto.new/")
-            async with websockets.connect(ws_url, max_size=2**20, extra_headers=ws_headers) as ws:
-                while True:
+            ws_session = _get_shared_ws_session(self._transport, self.IMPERSONATE, self._proxy, self._cookie)
+            async with ws_session.ws_connect(
+                ws_url,
+                headers=ws_headers,
+                proxy=self._ws_proxy,
+                heartbeat=15,
+                receive_timeout=self.WS_RECEIVE_TIMEOUT,
+                max_msg_size=2**20,
+            ) as ws:
+                # 收帧放在独立任务中，与解析、消费解耦，消费方较慢时也能持续排空 socket
+                queue: "asyncio.Queue[Any]" = asyncio.Queue(self.WS_QUEUE_SIZE)
+
+                async def _reader():
+                    # 空闲检测交给 heartbeat 与 receive_timeout：对端失联时连接被关闭、
+                    # 长时间无数据时抛出 TimeoutError，不再为每一帧创建 wait_for 的 Task 与定时器
                     try:
-                        msg = await asyncio.wait_for(ws.recv(), timeout=30.0)
-                        data = json.loads(msg)
-
-                        if data.get("type") == "update" and data.get("buffer"):
-                            inner = json.loads(data["buffer"])
-                            if inner.get("type") == "chat":
-                                content = inner.get("chat", {}).get("content", "")
-                                if content:
-                                    yield content
-                        elif data.get("type") == "state" and not data["state"].get("inProgress"):
-                            break
-                    except (json.JSONDecodeError, KeyError):
-                        continue
-                    except asyncio.TimeoutError:
-                        break
-        except (ConnectionClosed, asyncio.TimeoutError):
+                        async for raw in ws:
+                            await queue.put(raw)
+                    except Exception as exc:
+                        await queue.put(exc)
+                        return
+                    await queue.put(None)
+
+                reader = asyncio.create_task(_reader())
+                try:
+                    done = False
+                    while not done:
+                        pieces: List[str] = []
+                        msg = await queue.get()
+                        while True:
+                            try:
+                                content, done = self._read_ws_message(msg)
+                            except Exception:
+                                # 出错前已合并的内容照常产出，再抛出异常
+                                if pieces:
+                                    text = "".join(pieces)
+                                    yield text.encode("utf-8") if as_bytes else text
+                                raise
+                            if content:
+                                pieces.append(content)
+                            if done or not coalesce or queue.empty():
+                                break
+                            msg = queue.get_nowait()
+                        # 收到结束帧后立即结束迭代并取消读任务，不等待对端关闭连接
+                        if pieces:
+                            text = pieces[0] if len(pieces) == 1 else "".join(pieces)
+                            yield text.encode("utf-8") if as_bytes else text
+                finally:
+                    reader.cancel()
+        except asyncio.TimeoutError:
             pass
         except Exception as e:
             raise ApiError(f"WebSocket 通信错误：{e}") from e
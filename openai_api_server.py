@@ -4,18 +4,27 @@ OpenAI 格式兼容的 API 服务器
 """
 
 import asyncio
-import json
+import atexit
+import functools
+import itertools
+import logging
+import logging.handlers
 import os
+import queue
 import time
 import uuid
+from collections import defaultdict
 from pathlib import Path
-from typing import Optional, List, Dict, Any, AsyncGenerator, Union, Literal
+from typing import Optional, List, Dict, Any, AsyncGenerator, DefaultDict, Iterator, Tuple, Union, Literal
 
+import anyio
+import orjson
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import StreamingResponse, JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse, Response
+from pydantic import BaseModel, Field, ValidationError
 from starlette.status import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_502_BAD_GATEWAY
+from starlette.types import Send
 
 from cto_new_client import CtoNewClient, AuthError, ApiError
 
@@ -27,6 +36,30 @@ except ImportError:
     tiktoken = None
     encoding = None
 
+
+# ========== 日志 ==========
+def _setup_logger() -> logging.Logger:
+    """
+    请求路径上只把日志记录放进内存队列，由后台线程的 QueueListener 写 stderr，
+    避免 stdout/stderr 写入阻塞事件循环。不改动根 logger，以免与 uvicorn 的日志配置冲突。
+    """
+    log = logging.getLogger(__name__)
+    if log.handlers:
+        return log
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    return log
+
+
+logger = _setup_logger()
+
 # ========== 配置 ==========
 COOKIES_DIR = Path(__file__).with_name("cookies")
 COOKIES_FILE = COOKIES_DIR / "cookies.txt"
@@ -37,59 +70,142 @@ MODEL_MAPPING = {
     "claude-sonnet-4-5": "ClaudeSonnet4_5",
 }
 DEFAULT_ADAPTER = "ClaudeSonnet4_5"
-PROXY_URL = os.getenv("PROXY_URL")  # 支持通过环境变量配置代理, e.g., "http://127.0.0.1:7890"
+# 支持通过环境变量配置代理, e.g., "http://127.0.0.1:7890"；socks 代理只作用于 HTTP 请求，WebSocket 流直连
+PROXY_URL = os.getenv("PROXY_URL")
+
+# /v1/models 的内容在进程生命周期内不变，启动时序列化一次
+_MODELS_PAYLOAD = orjson.dumps(
+    {
+        "object": "list",
+        "data": [
+            {"id": model_name, "object": "model", "created": int(time.time()), "owned_by": "cto-new"}
+            for model_name in MODEL_MAPPING
+        ],
+    }
+)
 
 
-# ========== 线程安全的 Cookie 管理器 ==========
+# ========== Cookie 管理器 ==========
 class CookieManager:
     def __init__(self, file_path: Path):
         self._file_path = file_path
         self._dir_path = file_path.parent
         self._cookies: List[str] = []
-        self._index = 0
-        self._mtime: Optional[float] = None
-        self._lock = asyncio.Lock()
-        self._load_cookies()
+        self._cycle: Iterator[str] = iter(())
+        self._mtime_ns: Optional[int] = None
+        # 首次 get_cookie() 时才读盘，避免导入阶段阻塞启动
 
     def _load_cookies(self):
         try:
             if not self._dir_path.exists():
                 raise FileNotFoundError(f"Cookie 目录不存在: {self._dir_path}")
 
-            current_mtime = self._file_path.stat().st_mtime
-            if self._mtime is not None and self._mtime == current_mtime:
+            current_mtime_ns = os.stat(self._file_path).st_mtime_ns
+            if self._mtime_ns is not None and self._mtime_ns == current_mtime_ns:
                 return
 
-            with open(self._file_path, "r", encoding="utf-8") as f:
-                raw_lines = f.readlines()
-
-            cookies = [line.strip() for line in raw_lines if line.strip() and not line.strip().startswith("#")]
+            # 一次性读入并解码，再按行切分，避免逐行经过 TextIOWrapper
+            raw_lines = self._file_path.read_bytes().decode("utf-8").splitlines()
+            stripped = (line.strip() for line in raw_lines)
+            cookies = [line for line in stripped if line and not line.startswith("#")]
             if not cookies:
                 raise ValueError(f"No cookies found in {self._file_path}")
 
             self._cookies = cookies
-            self._index = 0
-            self._mtime = current_mtime
-            print(f"成功加载 {len(self._cookies)} 个 cookies")
+            self._cycle = itertools.cycle(cookies)
+            self._mtime_ns = current_mtime_ns
+            logger.info("成功加载 %d 个 cookies", len(self._cookies))
 
         except FileNotFoundError as exc:
             self._cookies = []
-            print(f"警告：{exc}")
+            logger.warning("%s", exc)
         except ValueError as e:
-            print(f"警告：{e}")
+            logger.warning("%s", e)
+
+    def _file_unchanged(self) -> bool:
+        if self._mtime_ns is None:
+            return False
+        try:
+            return os.stat(self._file_path).st_mtime_ns == self._mtime_ns
+        except OSError:
+            return False
 
     async def get_cookie(self) -> str:
-        async with self._lock:
+        # 检查与重新加载都是同步的，中间没有 await，在事件循环内天然互斥，无需加锁
+        if not (self._cookies and self._file_unchanged()):
             self._load_cookies()
             if not self._cookies:
                 raise ValueError("Cookie 池为空")
+        return next(self._cycle)
+
+
+@functools.cache
+def get_cookie_manager() -> CookieManager:
+    """进程内唯一的 CookieManager 实例"""
+    return CookieManager(COOKIES_FILE)
 
-            cookie = self._cookies[self._index]
-            self._index = (self._index + 1) % len(self._cookies)
-            return cookie
 
+# ========== 按 cookie 复用的客户端池 ==========
+# 同一 cookie 的 Clerk 会话信息在 TTL 内复用，JWT 过期时由 authenticate() 自行刷新
+CLIENT_TTL = 600.0
+_CLIENT_POOL: Dict[str, Tuple[CtoNewClient, float]] = {}
+_CLIENT_LOCKS: DefaultDict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+# cookie 被拒绝后移出池、等待延后关闭的客户端及其移出时间
+_RETIRED_CLIENTS: List[Tuple[CtoNewClient, float]] = []
 
-cookie_manager = CookieManager(COOKIES_FILE)
+
+async def _prune_stale_clients():
+    """
+    关闭并移除不再被请求的过期客户端，避免 cookie 轮换后池与锁无限增长。
+    过期后再多保留一个 TTL 才清理：期间仍在进行的流持有的是该实例的会话；
+    被拒绝而移出池的客户端同样在移出一个 TTL 后才关闭
+    """
+    now = time.monotonic()
+    stale = [cookie for cookie, (_, created) in _CLIENT_POOL.items() if now - created >= 2 * CLIENT_TTL]
+    # 先同步摘除再逐个关闭，关闭期间并发进入的清理不会重复处理同一实例
+    clients = [_CLIENT_POOL.pop(cookie)[0] for cookie in stale]
+    for cookie in stale:
+        lock = _CLIENT_LOCKS.get(cookie)
+        if lock is not None and not lock.locked():
+            del _CLIENT_LOCKS[cookie]
+    clients += [client for client, retired in _RETIRED_CLIENTS if now - retired >= CLIENT_TTL]
+    _RETIRED_CLIENTS[:] = [item for item in _RETIRED_CLIENTS if now - item[1] < CLIENT_TTL]
+    for client in clients:
+        await client.close()
+
+
+async def get_client(cookie: str) -> CtoNewClient:
+    """返回该 cookie 已认证的客户端；并发的首次请求只认证一次"""
+    entry = _CLIENT_POOL.get(cookie)
+    if entry is None or time.monotonic() - entry[1] >= CLIENT_TTL:
+        # 只在需要新建客户端时顺带清理，命中池的快速路径不受影响
+        await _prune_stale_clients()
+        async with _CLIENT_LOCKS[cookie]:
+            entry = _CLIENT_POOL.get(cookie)
+            if entry is None or time.monotonic() - entry[1] >= CLIENT_TTL:
+                client = CtoNewClient(cookie, proxy=PROXY_URL)
+                try:
+                    await client.authenticate()
+                except Exception:
+                    await client.close()
+                    raise
+                _CLIENT_POOL[cookie] = (client, time.monotonic())
+                if entry is not None:
+                    # 新客户端已持有共享会话的引用，关闭旧实例不会影响仍在进行中的流
+                    await entry[0].close()
+                return client
+
+    client = entry[0]
+    try:
+        await client.authenticate()
+    except AuthError as exc:
+        # 只有 Clerk 明确拒绝（401/403）才说明 cookie 失效，网络抖动等暂时性错误保留池中实例；
+        # 同一 cookie 的并发请求共用该实例，立即关闭会断开它们仍在进行的流，因此只移出池、延后关闭
+        if exc.rejected and _CLIENT_POOL.get(cookie) is entry:
+            del _CLIENT_POOL[cookie]
+            _RETIRED_CLIENTS.append((client, time.monotonic()))
+        raise
+    return client
 
 
 # ========== OpenAI 兼容辅助 ==========
@@ -138,65 +254,46 @@ class ChatCompletionRequest(BaseModel):
     max_tokens: Optional[int] = None
 
 
-class Usage(BaseModel):
-    prompt_tokens: int = 0
-    completion_tokens: int = 0
-    total_tokens: int = 0
-
-
-class ChatCompletionChoice(BaseModel):
-    index: int
-    message: Message
-    finish_reason: str
-
-
-class ChatCompletionResponse(BaseModel):
-    id: str
-    object: str = "chat.completion"
-    created: int
-    model: str
-    choices: List[ChatCompletionChoice]
-    usage: Usage
-
-
 # ========== FastAPI App & Lifecycle ==========
 # CtoNewClient 内部管理其网络会话，不再需要全局的 lifespan 管理器
-app = FastAPI(title="OpenAI Compatible API", version="1.2.0")
+app = FastAPI(title="OpenAI Compatible API", version="1.2.0", default_response_class=ORJSONResponse)
 
 
 # ========== 辅助函数 ==========
-def count_tokens(text: str) -> int:
-    """使用 tiktoken 计算 token 数量，如果库不可用则返回 0"""
+def count_tokens_batch(texts: List[str]) -> List[int]:
+    """批量计算 token 数量，tiktoken 在 Rust 侧并行编码，如果库不可用则全部返回 0"""
     if not encoding:
-        return 0
-    return len(encoding.encode(text))
+        return [0] * len(texts)
+    return [len(ids) for ids in encoding.encode_ordinary_batch(texts)]
 
 
 def format_chat_history(messages: List[Message]) -> str:
     """将聊天历史格式化为单个字符串 prompt"""
-    rendered_messages: List[str] = []
-    for index, msg in enumerate(messages):
-        content = render_message_content(msg.content, index)
-        rendered_messages.append(f"{msg.role}: {content}")
-    return "\n".join(rendered_messages)
-
-
-def render_message_content(content: Union[str, List[MessageContentPart]], message_index: int) -> str:
-    if isinstance(content, str):
-        return content
-
-    segments: List[str] = []
-    for part_index, part in enumerate(content):
-        if part.type != "text":
-            raise openai_http_exception(
-                HTTP_400_BAD_REQUEST,
-                f"Unsupported content part type '{part.type}'. Only 'text' is supported.",
-                param=f"messages[{message_index}].content[{part_index}].type",
-                code="unsupported_message_content_type",
-            )
-        segments.append(part.text)
+    # 所有片段追加到同一个列表，最后只 join 一次
+    parts: List[str] = []
+    append = parts.append
+    for message_index, msg in enumerate(messages):
+        if message_index:
+            append("\n")
+        append(msg.role)
+        append(": ")
+
+        content = msg.content
+        if isinstance(content, str):
+            append(content)
+            continue
+
+        for part_index, part in enumerate(content):
+            if part.type != "text":
+                raise openai_http_exception(
+                    HTTP_400_BAD_REQUEST,
+                    f"Unsupported content part type '{part.type}'. Only 'text' is supported.",
+                    param=f"messages[{message_index}].content[{part_index}].type",
+                    code="unsupported_message_content_type",
+                )
+            append(part.text)
 
-    return "".join(segments)
+    return "".join(parts)
 
 
 # ========== 异常处理 ==========
@@ -224,7 +321,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 
 @app.exception_handler(Exception)
 async def unhandled_exception_handler(request: Request, exc: Exception):
-    print(f"未处理异常: {exc}")
+    logger.error("未处理异常: %s", exc, exc_info=exc)
     return JSONResponse(
         status_code=HTTP_500_INTERNAL_SERVER_ERROR,
         content=build_openai_error(
@@ -235,41 +332,82 @@ async def unhandled_exception_handler(request: Request, exc: Exception):
     )
 
 
-async def stream_ai_response(client: CtoNewClient, chat_id: str, model: str) -> AsyncGenerator[str, None]:
+class EventStreamResponse(StreamingResponse):
+    """
+    SSE 响应：关闭反向代理缓冲，并定期发送注释帧保活，防止长时间生成时被代理断开。
+    帧本身已由 stream_ai_response 编码为 bytes，这里直接透传。
+    """
+
+    media_type = "text/event-stream"
+    PING_INTERVAL = 15.0
+    _PING_FRAME = b": ping\n\n"
+
+    def __init__(self, content, headers: Optional[Dict[str, str]] = None, **kwargs):
+        merged_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        if headers:
+            merged_headers.update(headers)
+        super().__init__(content, headers=merged_headers, **kwargs)
+
+    async def stream_response(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        # 保活帧与数据帧可能并发发送，用锁保证 ASGI 消息不交错
+        send_lock = asyncio.Lock()
+
+        async def send_body(chunk: bytes):
+            async with send_lock:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+        async def ping():
+            while True:
+                await anyio.sleep(self.PING_INTERVAL)
+                await send_body(self._PING_FRAME)
+
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(ping)
+            async for chunk in self.body_iterator:
+                if not isinstance(chunk, (bytes, memoryview)):
+                    chunk = chunk.encode(self.charset)
+                await send_body(chunk)
+            task_group.cancel_scope.cancel()
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+# SSE 帧模板：除 id / created / model（以及内容帧的 content）外完全固定，按字节格式化即可
+_CHUNK_HEAD = b'data: {"id":%s,"object":"chat.completion.chunk","created":%d,"model":%s,'
+_ROLE_TEMPLATE = _CHUNK_HEAD + b'"choices":[{"index":0,"delta":{"role":"assistant"},"finish_reason":null}]}\n\n'
+_FINAL_TEMPLATE = _CHUNK_HEAD + b'"choices":[{"index":0,"delta":{},"finish_reason":"stop"}]}\n\n'
+_CONTENT_PREFIX_TEMPLATE = _CHUNK_HEAD + b'"choices":[{"index":0,"delta":{"content":'
+_CONTENT_SUFFIX = b'},"finish_reason":null}]}\n\n'
+_DONE = b"data: [DONE]\n\n"
+
+
+def _sse(obj: Dict[str, Any]) -> bytes:
+    """将对象编码为一条 SSE data 帧"""
+    return b"data: " + orjson.dumps(obj) + b"\n\n"
+
+
+async def stream_ai_response(client: CtoNewClient, chat_id: str, model: str) -> AsyncGenerator[bytes, None]:
     """使用 CtoNewClient 流式获取并格式化 AI 响应"""
     stream_id = f"chatcmpl-{chat_id}"
     created_time = int(time.time())
 
+    # id 与 model 来自外部输入，经 orjson 编码后再填入模板，保证转义正确
+    envelope = (orjson.dumps(stream_id), created_time, orjson.dumps(model))
+
     try:
-        role_chunk = {
-            "id": stream_id,
-            "object": "chat.completion.chunk",
-            "created": created_time,
-            "model": model,
-            "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}],
-        }
-        yield f"data: {json.dumps(role_chunk)}\n\n"
-
-        async for content_chunk in client.stream_chat_response(chat_id):
-            chunk = {
-                "id": stream_id,
-                "object": "chat.completion.chunk",
-                "created": created_time,
-                "model": model,
-                "choices": [{"index": 0, "delta": {"content": content_chunk}, "finish_reason": None}],
-            }
-            yield f"data: {json.dumps(chunk)}\n\n"
+        yield _ROLE_TEMPLATE % envelope
+
+        content_prefix = _CONTENT_PREFIX_TEMPLATE % envelope
+        # 合并已到达的相邻帧，减少 SSE 帧数与 ASGI send 次数；上游空闲时立即发出，不增加首字延迟。
+        # 这里有意消费 str：合并后的文本由 orjson.dumps 一次完成转义并直接得到 bytes，
+        # 让客户端预先产出 JSON 字面量反而要在合并时拆引号重拼，省不掉这次编码
+        async for content in client.stream_chat_response(chat_id, coalesce=True):
+            yield content_prefix + orjson.dumps(content) + _CONTENT_SUFFIX
 
         # 发送结束标记
-        final_chunk = {
-            "id": stream_id,
-            "object": "chat.completion.chunk",
-            "created": created_time,
-            "model": model,
-            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
-        }
-        yield f"data: {json.dumps(final_chunk)}\n\n"
-        yield "data: [DONE]\n\n"
+        yield _FINAL_TEMPLATE % envelope
+        yield _DONE
 
     except ApiError as e:
         # 在流中报告错误
@@ -280,8 +418,8 @@ async def stream_ai_response(client: CtoNewClient, chat_id: str, model: str) ->
             "model": model,
             "choices": [{"index": 0, "delta": {"content": f"\n\n[ERROR: {e}]"}, "finish_reason": "stop"}],
         }
-        yield f"data: {json.dumps(error_chunk)}\n\n"
-        yield "data: [DONE]\n\n"
+        yield _sse(error_chunk)
+        yield _DONE
 
 
 # ========== API Routes ==========
@@ -297,27 +435,47 @@ async def root():
 @app.get("/v1/models")
 async def list_models():
     """列出可用模型"""
-    return {
-        "object": "list",
-        "data": [
-            {"id": model_name, "object": "model", "created": int(time.time()), "owned_by": "cto-new"}
-            for model_name in MODEL_MAPPING.keys()
-        ],
-    }
+    return Response(content=_MODELS_PAYLOAD, media_type="application/json")
+
+
+async def parse_chat_request(req: Request) -> ChatCompletionRequest:
+    """
+    用 orjson 解析请求体并直接 model_validate，省去 FastAPI 自带的 JSON 解析与 body 校验。
+    错误统一转换为 RequestValidationError，保持与原先一致的 OpenAI 错误格式。
+    """
+    body = await req.body()
+    if not body:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "Field required", "input": None}])
+    try:
+        raw = orjson.loads(body)
+    except orjson.JSONDecodeError as exc:
+        raise RequestValidationError(
+            [
+                {
+                    "type": "json_invalid",
+                    "loc": ("body", exc.pos),
+                    "msg": "JSON decode error",
+                    "input": {},
+                    "ctx": {"error": exc.msg},
+                }
+            ]
+        ) from exc
+    try:
+        return ChatCompletionRequest.model_validate(raw)
+    except ValidationError as exc:
+        raise RequestValidationError(exc.errors(include_url=False), body=raw) from exc
 
 
 @app.post("/v1/chat/completions")
-async def chat_completions(req: Request, payload: ChatCompletionRequest):
+async def chat_completions(req: Request):
     """
     OpenAI 兼容的聊天完成接口
     支持流式和非流式响应
     """
+    payload = await parse_chat_request(req)
     try:
-        cookie = await cookie_manager.get_cookie()
-        client = CtoNewClient(cookie, proxy=PROXY_URL)
-
-        # 认证
-        await client.authenticate()
+        cookie = await get_cookie_manager().get_cookie()
+        client = await get_client(cookie)
 
         # 确定 adapter 并格式化 prompt
         adapter = MODEL_MAPPING.get(payload.model, DEFAULT_ADAPTER)
@@ -350,26 +508,40 @@ async def chat_completions(req: Request, payload: ChatCompletionRequest):
 
         # 流式响应
         if payload.stream:
-            return StreamingResponse(stream_ai_response(client, chat_id, payload.model), media_type="text/event-stream")
+            return EventStreamResponse(stream_ai_response(client, chat_id, payload.model))
 
         # 非流式响应
-        response_chunks = [chunk async for chunk in client.stream_chat_response(chat_id)]
-        response_content = "".join(response_chunks)
-
-        return ChatCompletionResponse(
-            id=f"chatcmpl-{chat_id}",
-            created=int(time.time()),
-            model=payload.model,
-            choices=[
-                ChatCompletionChoice(
-                    index=0, message=Message(role="assistant", content=response_content), finish_reason="stop"
-                )
-            ],
-            usage=Usage(
-                prompt_tokens=count_tokens(prompt),
-                completion_tokens=count_tokens(response_content),
-                total_tokens=count_tokens(prompt) + count_tokens(response_content),
-            ),
+        # 累积到单个连续缓冲区，避免整段生成期间保留每个分块的 str 对象
+        buf = bytearray()
+        async for chunk in client.stream_chat_response(chat_id):
+            buf += chunk.encode("utf-8")
+        response_content = buf.decode("utf-8")
+        # 编码是同步的 CPU 计算，放到线程中执行，避免阻塞其他流式请求；tiktoken 不可用时无需切换线程
+        if encoding is None:
+            prompt_tokens = completion_tokens = 0
+        else:
+            prompt_tokens, completion_tokens = await asyncio.to_thread(count_tokens_batch, [prompt, response_content])
+
+        # 按 OpenAI chat.completion 的响应结构直接构造 dict 交给 orjson，跳过出口处的模型校验与 jsonable_encoder
+        return ORJSONResponse(
+            content={
+                "id": f"chatcmpl-{chat_id}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": response_content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
         )
 
     except HTTPException:
@@ -389,7 +561,7 @@ async def chat_completions(req: Request, payload: ChatCompletionRequest):
         )
     except Exception as e:
         # 捕获所有其他意外错误
-        print(f"发生意外错误：{e}")
+        logger.exception("发生意外错误：%s", e)
         raise openai_http_exception(
             HTTP_500_INTERNAL_SERVER_ERROR,
             "Internal server error.",
@@ -7,8 +7,10 @@
 """
 
 import random
+import re
 from dataclasses import dataclass
-from typing import Dict, Optional
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
 from urllib.parse import urlparse
 
 from fake_useragent import UserAgent
@@ -26,6 +28,10 @@ _ACCEPT_ENCODING_CANDIDATES = [
     "gzip, deflate, br",
     "gzip, deflate",
 ]
+# 语言与编码的所有组合，一次 random.choice 同时选出两者
+_LANGUAGE_ENCODING_PAIRS = [
+    (language, encoding) for language in _ACCEPT_LANGUAGE_CANDIDATES for encoding in _ACCEPT_ENCODING_CANDIDATES
+]
 
 
 def get_user_agent_instance() -> UserAgent:
@@ -80,63 +86,97 @@ def get_random_user_agent(browser_type: Optional[str] = None) -> str:
     return user_agent
 
 
+# 浏览器/平台关键字各用一个预编译正则单次扫描 UA；命中可能不止一个（如 Edge UA 同时含 Chrome/ 与 Safari），
+# 因此收集全部命中后按下列优先级选择，与逐个 `in` 判断的结果一致
+_BROWSER_PATTERN = re.compile(r"edg/|chrome/|firefox/|safari", re.IGNORECASE)
+_BROWSER_PRIORITY = (("edg/", "edge"), ("chrome/", "chrome"), ("firefox/", "firefox"), ("safari", "safari"))
+_PLATFORM_PATTERN = re.compile(r"Windows|Mac OS X|Macintosh|Android|iPhone|iPad|Linux")
+_PLATFORM_PRIORITY = (
+    (("Windows",), '"Windows"'),
+    (("Mac OS X", "Macintosh"), '"macOS"'),
+    (("Android",), '"Android"'),
+    (("iPhone", "iPad"), '"iOS"'),
+    (("Linux",), '"Linux"'),
+)
+
+
+@lru_cache(maxsize=256)
 def _detect_browser_type(user_agent: str) -> str:
-    ua_lower = user_agent.lower()
-    if "edg/" in ua_lower:
-        return "edge"
-    if "chrome/" in ua_lower:
-        return "chrome"
-    if "firefox/" in ua_lower:
-        return "firefox"
-    if "safari" in ua_lower:
-        return "safari"
+    found = {match.lower() for match in _BROWSER_PATTERN.findall(user_agent)}
+    for token, browser in _BROWSER_PRIORITY:
+        if token in found:
+            return browser
     return "chrome"
 
 
+@lru_cache(maxsize=256)
 def _detect_platform(user_agent: str) -> str:
-    if "Windows" in user_agent:
-        return '"Windows"'
-    if "Mac OS X" in user_agent or "Macintosh" in user_agent:
-        return '"macOS"'
-    if "Android" in user_agent:
-        return '"Android"'
-    if "iPhone" in user_agent or "iPad" in user_agent:
-        return '"iOS"'
-    if "Linux" in user_agent:
-        return '"Linux"'
+    found = set(_PLATFORM_PATTERN.findall(user_agent))
+    for tokens, platform in _PLATFORM_PRIORITY:
+        if not found.isdisjoint(tokens):
+            return platform
     return '"Windows"'
 
 
+@lru_cache(maxsize=256)
+def _chromium_client_hints(user_agent: str) -> Tuple[str, str]:
+    """根据 UA 推导 Chrome/Edge 的 sec-ch-ua 与 sec-ch-ua-platform"""
+    chrome_version = "126"  # 默认值
+
+    try:
+        if "Chrome/" in user_agent:
+            chrome_version = user_agent.split("Chrome/")[1].split(".")[0]
+    except IndexError:
+        pass
+
+    sec_ch_ua_parts = []
+    if "Edg/" in user_agent:
+        try:
+            edge_version = user_agent.split("Edg/")[1].split(".")[0]
+            sec_ch_ua_parts.append(f'"Microsoft Edge";v="{edge_version}"')
+        except IndexError:
+            pass
+
+    sec_ch_ua_parts.append(f'"Chromium";v="{chrome_version}"')
+
+    if "Google Chrome" in user_agent:
+        sec_ch_ua_parts.append(f'"Google Chrome";v="{chrome_version}"')
+
+    sec_ch_ua_parts.append('"Not_A Brand";v="8"')
+
+    return ", ".join(sec_ch_ua_parts), _detect_platform(user_agent)
+
+
+@lru_cache(maxsize=1024)
+def _host_and_site(value: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """解析 URL 的 host 及其站点（最后两级域名），输入集合很小，按值缓存避免重复 urlparse"""
+    if not value:
+        return None, None
+    parsed = urlparse(value) if "://" in value else urlparse(f"https://{value}")
+    host = (parsed.netloc or parsed.path or "").lower() or None
+    if not host:
+        return None, None
+    parts = host.split(".")
+    site = ".".join(parts[-2:]) if len(parts) >= 2 else host
+    return host, site
+
+
 def _infer_fetch_site(origin: Optional[str], referer: Optional[str], target_url: Optional[str]) -> str:
-    def _normalize_host(value: Optional[str]) -> Optional[str]:
-        if not value:
-            return None
-        parsed = urlparse(value) if "://" in value else urlparse(f"https://{value}")
-        return (parsed.netloc or parsed.path or "").lower() or None
-
-    def _site(host: Optional[str]) -> Optional[str]:
-        if not host:
-            return None
-        parts = host.split(".")
-        if len(parts) >= 2:
-            return ".".join(parts[-2:])
-        return host
-
-    origin_host = _normalize_host(origin)
-    referer_host = _normalize_host(referer)
-    target_host = _normalize_host(target_url)
+    origin_host, origin_site = _host_and_site(origin)
+    referer_host, referer_site = _host_and_site(referer)
+    target_host, target_site = _host_and_site(target_url)
 
     if target_host and origin_host:
         if origin_host == target_host:
             return "same-origin"
-        if _site(origin_host) and _site(origin_host) == _site(target_host):
+        if origin_site and origin_site == target_site:
             return "same-site"
         return "cross-site"
 
     if target_host and referer_host:
         if referer_host == target_host:
             return "same-origin"
-        if _site(referer_host) and _site(referer_host) == _site(target_host):
+        if referer_site and referer_site == target_site:
             return "same-site"
         return "cross-site"
 
@@ -161,8 +201,7 @@ class BrowserFingerprint:
             browser_type = random.choice(["chrome", "chrome", "edge", "firefox", "safari"])
         user_agent = get_random_user_agent(browser_type)
         resolved_browser_type = _detect_browser_type(user_agent)
-        accept_language = random.choice(_ACCEPT_LANGUAGE_CANDIDATES)
-        accept_encoding = random.choice(_ACCEPT_ENCODING_CANDIDATES)
+        accept_language, accept_encoding = random.choice(_LANGUAGE_ENCODING_PAIRS)
         return cls(
             user_agent=user_agent,
             browser_type=resolved_browser_type,
@@ -236,9 +275,11 @@ def get_dynamic_headers(
     if browser_type is None:
         browser_type = _detect_browser_type(user_agent)
 
-    if accept_language is None:
+    if accept_language is None and accept_encoding is None:
+        accept_language, accept_encoding = random.choice(_LANGUAGE_ENCODING_PAIRS)
+    elif accept_language is None:
         accept_language = random.choice(_ACCEPT_LANGUAGE_CANDIDATES)
-    if accept_encoding is None:
+    elif accept_encoding is None:
         accept_encoding = random.choice(_ACCEPT_ENCODING_CANDIDATES)
 
     # 基础 headers
@@ -261,35 +302,14 @@ def get_dynamic_headers(
 
     # 根据用户代理添加浏览器特定的 headers
     if browser_type in {"chrome", "edge"}:
-        # Chrome/Edge 特定的 headers
-        chrome_version = "126"  # 默认值
-
-        try:
-            if "Chrome/" in user_agent:
-                chrome_version = user_agent.split("Chrome/")[1].split(".")[0]
-        except IndexError:
-            pass
-
-        sec_ch_ua_parts = []
-        if "Edg/" in user_agent:
-            try:
-                edge_version = user_agent.split("Edg/")[1].split(".")[0]
-                sec_ch_ua_parts.append(f'"Microsoft Edge";v="{edge_version}"')
-            except IndexError:
-                pass
-
-        sec_ch_ua_parts.append(f'"Chromium";v="{chrome_version}"')
-
-        if "Google Chrome" in user_agent:
-            sec_ch_ua_parts.append(f'"Google Chrome";v="{chrome_version}"')
-
-        sec_ch_ua_parts.append('"Not_A Brand";v="8"')
+        # Chrome/Edge 特定的 headers，只取决于 UA，按 UA 缓存
+        sec_ch_ua, platform = _chromium_client_hints(user_agent)
 
         headers.update(
             {
-                "sec-ch-ua": ", ".join(sec_ch_ua_parts),
+                "sec-ch-ua": sec_ch_ua,
                 "sec-ch-ua-mobile": "?0",
-                "sec-ch-ua-platform": _detect_platform(user_agent),
+                "sec-ch-ua-platform": platform,
                 "Sec-Fetch-Dest": "empty",
                 "Sec-Fetch-Mode": "cors",
                 "Sec-Fetch-Site": _infer_fetch_site(origin, referer, target_url),
@@ -1,81 +1,264 @@
 import asyncio
+import contextlib
+import functools
+import os
+import select
+import socket
+import sys
+import threading
+import uuid
 from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
 
 import httpx
 from cto_new_client import CtoNewClient, CtoNewError
 
+try:
+    import h2  # noqa: F401  # 安装 httpx[http2] 后可用
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
 # ========== ⚙️ 配置区 ==========
 # 从 cookies/cookies.txt 读取第一个 cookie
 COOKIES_PATH = Path(__file__).with_name("cookies") / "cookies.txt"
 
+
+def read_first_line(path: Path, chunk_size: int = 8192) -> bytes:
+    """只读到第一个换行为止，不经过 TextIOWrapper / BufferedReader"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        raw = b""
+        while chunk := os.read(fd, chunk_size):
+            raw += chunk
+            newline = raw.find(b"\n")
+            if newline >= 0:
+                return raw[:newline]
+        return raw
+    finally:
+        os.close(fd)
+
+
 try:
-    with open(COOKIES_PATH, "r", encoding="utf-8") as f:
-        COOKIES = f.readline().strip()
+    COOKIES = read_first_line(COOKIES_PATH).strip().decode("utf-8")
     if not COOKIES:
         raise FileNotFoundError
-except FileNotFoundError:
+except (OSError, UnicodeDecodeError):
     print(f"错误：未在 {COOKIES_PATH} 找到有效 cookie。请创建文件并添加至少一个 cookie。")
     exit(1)
 
 ADAPTER = "GPT5"  # 或者 "ClaudeSonnet4_5"
+
+# 预先绑定好 adapter 的发送函数与流式读取函数，见 main()
+SendFn = Callable[..., Awaitable[str]]
+StreamFn = Callable[[str], AsyncIterator[bytes]]
+
+# 单轮对话（POST + 流式回复）的总时限，秒
+TURN_TIMEOUT = 120
+
+# 退出指令；长度守卫让普通输入无需 lower()
+EXIT_COMMANDS = frozenset({"exit", "quit"})
+_EXIT_COMMAND_MAX_LEN = max(map(len, EXIT_COMMANDS))
+
+# 连接池：多轮对话复用 keep-alive 连接，可用时启用 HTTP/2 多路复用
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+# 关闭 Nagle，小请求（POST 头与 body）立即发出，不等待合包
+HTTP_SOCKET_OPTIONS = [(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)]
 # ==============================
 
 
+class BatchedStdout:
+    """
+    把流式分块攒批写到 stdout，避免逐 token 的 write + flush。
+    分块编码后累积在 bytearray 中，直接写入 sys.stdout.buffer，绕过 TextIOWrapper 的逐次编码与加锁；
+    累计达到 FLUSH_SIZE 字节、遇到换行，或距首个未写出分块超过 FLUSH_DELAY 秒时写出一次。
+    """
+
+    FLUSH_SIZE = 256
+    FLUSH_DELAY = 0.016
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._write = sys.stdout.buffer.write
+        self._flush = sys.stdout.buffer.flush
+
+    def write(self, chunk: Union[str, bytes]):
+        data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        self._buf += data
+        if len(self._buf) >= self.FLUSH_SIZE or b"\n" in data:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.FLUSH_DELAY, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # print() 写入的文本可能还在 TextIOWrapper 的缓冲区里，先刷出以保证输出顺序
+        sys.stdout.flush()
+        if self._buf:
+            self._write(self._buf)
+            self._buf.clear()
+        self._flush()
+
+
+def first_prompt_from_cli() -> Optional[str]:
+    """命令行参数，或 stdin 中已经就绪的第一行，作为首条消息；都没有时返回 None"""
+    if len(sys.argv) > 1:
+        return " ".join(sys.argv[1:]).strip() or None
+    try:
+        ready, _, _ = select.select([sys.stdin], [], [], 0)
+    except (OSError, ValueError):  # Windows 上 select 不支持非 socket 句柄
+        return None
+    if ready:
+        return sys.stdin.readline().strip() or None
+    return None
+
+
+async def ainput(prompt: str) -> str:
+    """
+    在守护线程里执行 input()，等待用户输入期间事件循环仍能处理连接保活。
+    不使用默认线程池：退出时线程池会等待仍阻塞在 stdin 上的线程。
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve(setter, value):
+        if not future.done():
+            setter(value)
+
+    def read():
+        try:
+            result = input(prompt)
+        except BaseException as exc:  # EOFError 等交给调用方处理
+            callback = (resolve, future.set_exception, exc)
+        else:
+            callback = (resolve, future.set_result, result)
+        try:
+            loop.call_soon_threadsafe(*callback)
+        except RuntimeError:  # 事件循环已关闭
+            pass
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
+
+
+async def warm_up(http_client: httpx.AsyncClient):
+    """
+    提前与聊天接口所在主机（与 Clerk 认证不是同一个）建立 TCP/TLS 连接，
+    连接随后留在连接池中，第一次 create_chat 无需再握手。响应内容无关紧要。
+    """
+    with contextlib.suppress(httpx.HTTPError):
+        await http_client.head(CtoNewClient.BASE_URL)
+
+
+async def print_response(stream: StreamFn, chat_id: str, out: BatchedStdout):
+    """流式打印一轮回复；客户端在收到结束帧时即结束迭代，这里无需额外的结束信号"""
+    print("\n🤖 Assistant:")
+    try:
+        async for chunk in stream(chat_id):
+            out.write(chunk)
+    finally:
+        out.flush()
+    print("\n" + "=" * 20)
+
+
+async def send_prompt(send: SendFn, stream: StreamFn, prompt: str, chat_id: str, out: BatchedStdout):
+    """
+    发送 prompt 并流式打印回复。必须等 POST 返回后再订阅流：从第二轮起 chat_id 沿用上一轮，
+    提前订阅可能先收到上一轮已结束的状态（inProgress: false），导致本轮没有任何输出就结束。
+    整轮受 TURN_TIMEOUT 限制（httpx 的超时只针对单次读取，慢速涓流会不断重置它），超时抛出 TimeoutError。
+    """
+    # 逐块读取与写出直接迭代异步生成器，不创建任务，也就没有 Context 拷贝。
+    # 示例本身不使用 contextvars，因此无需自定义 task factory。
+    async with asyncio.timeout(TURN_TIMEOUT):
+        await send(prompt, chat_id=chat_id)
+        await print_response(stream, chat_id, out)
+
+
 async def main():
     """
     使用 CtoNewClient 与 cto.new 服务进行交互式聊天。
     """
-    async with httpx.AsyncClient(timeout=30.0) as http_client:
-        client = CtoNewClient(cookie=COOKIES, client=http_client)
+    # 显式传入 transport 时，连接池参数与 http2 需要设置在 transport 上
+    transport = httpx.AsyncHTTPTransport(
+        http2=HTTP2_AVAILABLE,
+        limits=HTTP_LIMITS,
+        retries=1,
+        socket_options=HTTP_SOCKET_OPTIONS,
+    )
+    # 退出时 CtoNewClient 先于 http_client 关闭，释放它自己持有的 WebSocket 会话
+    async with (
+        httpx.AsyncClient(timeout=HTTP_TIMEOUT, transport=transport) as http_client,
+        CtoNewClient(cookie=COOKIES, transport="httpx", shared_client=http_client) as client,
+    ):
+        # 每轮都会用到，提前绑定方法与固定的 adapter
+        send = functools.partial(client.create_chat, adapter=ADAPTER)
+        # 直接拿 UTF-8 bytes，交给 BatchedStdout 原样写入 stdout.buffer
+        stream = functools.partial(client.stream_chat_response, as_bytes=True)
+        out = BatchedStdout()
+
+        # 预热与认证并发进行，握手耗时被认证的往返掩盖
+        warm_up_task = asyncio.create_task(warm_up(http_client))
 
         try:
             print("🚀 正在认证...")
             await client.authenticate()
             print("✅ 认证成功！")
 
-            # 创建一个新的聊天会话
-            initial_prompt = "你好"
-            print(f"🆕 正在创建新的聊天会话 (adapter: {ADAPTER})...")
-            chat_id = await client.create_chat(initial_prompt, ADAPTER)
-            print(f"✅ 会话创建成功，Chat ID: {chat_id}")
-
-            # 显示初始响应
-            print("\n🤖 Assistant:")
-            async for chunk in client.stream_chat_response(chat_id):
-                print(chunk, end="", flush=True)
-            print("\n" + "=" * 20)
-
-            # 进入交互式聊天循环
-            while True:
-                try:
-                    prompt = input("You: ").strip()
-                    if prompt.lower() in {"exit", "quit"}:
-                        print("👋 告辞！")
-                        break
-
-                    if not prompt:
-                        continue
-
-                    # 在同一个会话中发送新消息
-                    # 注意：cto.new 的这个流程可能不是标准的“多轮对话”，
-                    # 每次 POST 都是一次新的 prompt，但共享同一个 chat_id。
-                    # 这里的实现遵循了原脚本的逻辑。
-                    await client.create_chat(prompt, ADAPTER)
-
-                    print("\n🤖 Assistant:")
-                    async for chunk in client.stream_chat_response(chat_id):
-                        print(chunk, end="", flush=True)
-                    print("\n" + "=" * 20)
-
-                except (KeyboardInterrupt, EOFError):
-                    print("\n👋 告辞！")
-                    break
-
-        except CtoNewError as e:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(warm_up_task, timeout=2)
+
+            # 创建一个新的聊天会话；已有用户输入时直接作为首条消息，不再发送问候
+            initial_prompt = first_prompt_from_cli() or "你好"
+            chat_id = str(uuid.uuid4())
+            print(f"🆕 正在创建新的聊天会话 (adapter: {ADAPTER})，Chat ID: {chat_id}")
+            await send_prompt(send, stream, initial_prompt, chat_id, out)
+        except TimeoutError:
+            print("\n⏱️ 本轮响应超时")
+        except (CtoNewError, httpx.HTTPError) as e:
+            # 只处理预期内的网络/服务错误；其他异常说明代码有问题，保留完整的 traceback
             print(f"\n❌ 发生错误：{e}")
-        except Exception as e:
-            print(f"\n❌ 发生未知错误：{e}")
+            return
+        finally:
+            warm_up_task.cancel()
+
+        # 进入交互式聊天循环；try 只包住可能出错的那一步
+        while True:
+            try:
+                prompt = (await ainput("You: ")).strip()
+            # 等待输入时按 Ctrl-C，asyncio.run 会以取消主任务的方式通知
+            except (KeyboardInterrupt, EOFError, asyncio.CancelledError):
+                print("\n👋 告辞！")
+                break
+
+            if len(prompt) <= _EXIT_COMMAND_MAX_LEN and prompt.lower() in EXIT_COMMANDS:
+                print("👋 告辞！")
+                break
+
+            if not prompt:
+                continue
+
+            # 在同一个会话中发送新消息
+            # 注意：cto.new 的这个流程可能不是标准的“多轮对话”，
+            # 每次 POST 都是一次新的 prompt，但共享同一个 chat_id。
+            # 这里的实现遵循了原脚本的逻辑。
+            try:
+                await send_prompt(send, stream, prompt, chat_id, out)
+            except TimeoutError:
+                print("\n⏱️ 本轮响应超时")
+            except (CtoNewError, httpx.HTTPError) as e:
+                # 单轮失败不影响后续对话
+                print(f"\n❌ 发生错误：{e}")
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                print("\n👋 告辞！")
+                break
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # 安装了 uvloop 时使用它驱动事件循环，否则为默认循环（factory 为 None）
+    with asyncio.Runner(loop_factory=CtoNewClient.fast_loop_factory()) as runner:
+        runner.run(main())